@@ -1,15 +1,35 @@
+import asyncio
+import os
+from typing import Annotated
+
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, field_validator
-from datetime import datetime, timedelta
+from pydantic import BaseModel, Field, PrivateAttr, field_validator
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
 from dateutil import tz
 from skyfield.api import load, wgs84
-from math import atan2, degrees
+from skyfield.constants import tau
+from skyfield.framelib import ecliptic_J2000_frame
+from skyfield.functions import mxv, rot_z
+from skyfield.nutationlib import iau2000b
+import numpy as np
 
 app = FastAPI(title="Astro Engine API (Skyfield)")
 
-# Load timescale & ephemeris (Skyfield downloads DE421 automatically and caches it)
-ts = load.timescale()
-eph = load('de421.bsp')
+# Load timescale & ephemeris (Skyfield downloads DE421 automatically and caches it).
+# Set EPHEMERIS to use another kernel, e.g. a smaller excerpt holding only the
+# bodies and years we serve. Whatever the kernel spans, the position tables
+# below only cover TABLE_START_YEAR..TABLE_END_YEAR (~115 KB per year, per
+# worker), so long kernels like de440/de441 don't blow up startup memory:
+#   python -m jplephem excerpt --targets 1,2,3,4,5,6,7,8,9,10,199,299,301,399,499 \
+#       1900/1/1 2050/1/1 de421.bsp de421-excerpt.bsp
+EPHEMERIS = os.environ.get("EPHEMERIS", "de421.bsp")
+ENGINE = "skyfield_" + os.path.splitext(os.path.basename(EPHEMERIS))[0]
+
+# Bundled leap-second/ΔT tables: no IERS download or freshness check at startup
+ts = load.timescale(builtin=True)
+eph = load(EPHEMERIS)
+earth = eph["earth"]
 
 PLANET_KEYS = {
     "sun": "sun",
@@ -25,6 +45,58 @@ PLANET_KEYS = {
 }
 
 
+def spk_segments(body) -> tuple:
+    """
+    Return the jplephem segments that sum to `body`'s position relative to
+    the solar system barycenter, so they can be evaluated directly instead
+    of through Skyfield's position objects.
+    """
+    vector_functions = getattr(body, "vector_functions", (body,))
+    return tuple(vf.spk_segment for vf in vector_functions)
+
+
+# (name, segments) pairs, resolved against the ephemeris once at import
+PLANET_BODIES = tuple(
+    (name, spk_segments(eph[key])) for name, key in PLANET_KEYS.items()
+)
+EARTH_SEGMENTS = spk_segments(earth)
+
+# Sampling step (days) of the geocentric position tables; the Moon moves
+# ~13°/day so it gets a finer grid. Cubic interpolation on these grids
+# stays within ~0.3 arcsec of evaluating the ephemeris directly.
+TABLE_STEP_DAYS = {"moon": 0.25}
+DEFAULT_TABLE_STEP_DAYS = 1.0
+
+# Years the position tables (and so the charts) cover, clipped to the kernel.
+# Sampling starts/ends two days outside them for the interpolation stencil
+# and the one-hour retrograde look-back.
+TABLE_START_YEAR = int(os.environ.get("TABLE_START_YEAR", "1900"))
+TABLE_END_YEAR = int(os.environ.get("TABLE_END_YEAR", "2100"))
+TABLE_JD_MIN = ts.tdb(TABLE_START_YEAR, 1, 1).tdb - 2.0
+TABLE_JD_MAX = ts.tdb(TABLE_END_YEAR + 1, 1, 1).tdb + 2.0
+
+# Upper bound on charts per /batch_chart request. Enforced on the body type so
+# item validation stops at the first chart past it (the JSON is still decoded)
+MAX_BATCH_CHARTS = 1000
+
+# Constant ICRS -> J2000 ecliptic rotation (what `ecliptic_position()` uses)
+_ECLIPTIC_ROT = ecliptic_J2000_frame.rotation_at(None)
+
+
+def parse_date(v: str) -> date:
+    """Parse YYYY-MM-DD, using fromisoformat for the zero-padded layout."""
+    if len(v) == 10 and v[4] == v[7] == "-":
+        return date.fromisoformat(v)
+    return datetime.strptime(v, "%Y-%m-%d").date()
+
+
+def parse_time(v: str) -> time:
+    """Parse HH:MM (24h), using fromisoformat for the zero-padded layout."""
+    if len(v) == 5 and v[2] == ":":
+        return time.fromisoformat(v)
+    return datetime.strptime(v, "%H:%M").time()
+
+
 class ChartRequest(BaseModel):
     date: str
     time: str
@@ -32,11 +104,13 @@ class ChartRequest(BaseModel):
     lat: float
     lon: float
 
+    _dt_local: datetime = PrivateAttr()
+
     @field_validator("date")
     @classmethod
     def validate_date(cls, v):
         try:
-            datetime.strptime(v, "%Y-%m-%d")
+            parse_date(v)
             return v
         except Exception:
             raise ValueError("date must be YYYY-MM-DD")
@@ -45,31 +119,202 @@ class ChartRequest(BaseModel):
     @classmethod
     def validate_time(cls, v):
         try:
-            datetime.strptime(v, "%H:%M")
+            parse_time(v)
             return v
         except Exception:
             raise ValueError("time must be HH:MM (24h)")
 
+    def model_post_init(self, __context):
+        # Fields are validated by now; build the local datetime once
+        self._dt_local = datetime.combine(
+            parse_date(self.date), parse_time(self.time)
+        )
+
+    @property
+    def dt_local(self) -> datetime:
+        """Naive local datetime for `date` and `time`."""
+        return self._dt_local
+
 
 @app.get("/")
-def health_check():
+async def health_check():
     return {"status": "ok"}
 
 
-def to_utc(dt_local: datetime, tz_name: str) -> datetime:
+@lru_cache(maxsize=1024)
+def get_zone(tz_name: str):
+    """Look up a timezone by name, memoized across requests."""
     local_zone = tz.gettz(tz_name)
     if local_zone is None:
         raise ValueError(f"Unknown timezone: {tz_name}")
+    return local_zone
+
+
+def to_utc(dt_local: datetime, tz_name: str) -> datetime:
+    local_zone = get_zone(tz_name)
     return dt_local.replace(tzinfo=local_zone).astimezone(tz.UTC)
 
 
-def ecliptic_longitude(body, t, observer) -> float:
-    """Compute ecliptic longitude (0–360) from given observer."""
-    astrometric = observer.at(t).observe(body)
-    eclip = astrometric.ecliptic_position()
-    x, y, z = eclip.km
-    lon = (degrees(atan2(y, x)) + 360.0) % 360.0
-    return lon
+def skyfield_times(dts: list):
+    """
+    Build one Skyfield Time array for a list of UTC datetimes, so every
+    instant goes through Skyfield's vectorized NumPy path together.
+    Nutation uses the cheaper IAU 2000B model (sub-milliarcsecond agreement
+    with 2000A); Skyfield caches M, MT and gast on the Time once derived.
+    """
+    t = ts.from_datetimes(dts)
+    t._nutation_angles = iau2000b(t.tt)
+    return t
+
+
+def barycentric_km(segments, jd_tdb) -> np.ndarray:
+    """ICRS position (km) relative to the solar system barycenter."""
+    return sum(segment.compute(jd_tdb) for segment in segments)
+
+
+def build_position_table(bodies, step: float) -> tuple:
+    """
+    Sample the geocentric ICRS positions (km) of `bodies`, each given as its
+    `spk_segments()`, every `step` days across the ephemeris' span, clipped
+    to TABLE_START_YEAR..TABLE_END_YEAR.
+    Returns (jd0, step, samples) with samples shaped (n, len(bodies), 3).
+    """
+    segments = [s for body in bodies for s in body] + list(EARTH_SEGMENTS)
+    jd0 = max([s.start_jd for s in segments] + [TABLE_JD_MIN])
+    jd1 = min([s.end_jd for s in segments] + [TABLE_JD_MAX])
+    jd = jd0 + step * np.arange(max(int((jd1 - jd0) // step), 0))
+    # The interpolation stencil needs at least 4 samples
+    if len(jd) < 4:
+        raise ValueError(
+            f"TABLE_START_YEAR={TABLE_START_YEAR}..TABLE_END_YEAR={TABLE_END_YEAR}"
+            f" does not overlap {EPHEMERIS}'s span"
+        )
+
+    samples = np.empty((len(jd), len(bodies), 3))
+    # Chunked to bound jplephem's temporary coefficient arrays
+    chunk = 10_000
+    for i in range(0, len(jd), chunk):
+        jd_i = jd[i:i + chunk]
+        earth_km = barycentric_km(EARTH_SEGMENTS, jd_i)
+        for b, body in enumerate(bodies):
+            samples[i:i + chunk, b] = (barycentric_km(body, jd_i) - earth_km).T
+    return jd0, step, samples
+
+
+def interpolate_positions(table, t) -> np.ndarray:
+    """
+    Interpolate a `build_position_table()` table at Skyfield times `t`
+    with a 4-point (cubic) Lagrange stencil.
+    Returns an array of shape (n_bodies, 3, len(t)).
+    """
+    jd0, step, samples = table
+    u = ((t.whole - jd0) + t.tdb_fraction) / step
+    i = np.floor(u).astype(int)
+    f = u - i
+    weights = np.array([
+        -f * (f - 1) * (f - 2) / 6,
+        (f + 1) * (f - 1) * (f - 2) / 2,
+        -(f + 1) * f * (f - 2) / 2,
+        (f + 1) * f * (f - 1) / 6,
+    ])
+    nodes = samples[i + np.arange(-1, 3)[:, None]]  # (4, len(t), n_bodies, 3)
+    return np.einsum("kt,ktbj->bjt", weights, nodes)
+
+
+def table_range(table) -> tuple:
+    """TDB Julian dates (first, last) a position table can interpolate."""
+    jd0, step, samples = table
+    # The stencil needs one sample before and two after the point
+    return jd0 + step, jd0 + (len(samples) - 2) * step
+
+
+def build_position_tables() -> tuple:
+    """
+    Build one position table per sampling step in TABLE_STEP_DAYS, each
+    paired with the PLANET_BODIES rows it holds.
+    """
+    steps = [
+        TABLE_STEP_DAYS.get(name, DEFAULT_TABLE_STEP_DAYS)
+        for name, _ in PLANET_BODIES
+    ]
+    tables = []
+    for step in sorted(set(steps)):
+        rows = [r for r, s in enumerate(steps) if s == step]
+        bodies = [PLANET_BODIES[r][1] for r in rows]
+        tables.append((rows, build_position_table(bodies, step)))
+    return tuple(tables)
+
+
+# Precomputed at startup (~0.5 s, ~18 MB for DE421's 1900-2053) so requests
+# interpolate instead of evaluating every body's Chebyshev series
+POSITION_TABLES = build_position_tables()
+TABLES_JD_START = max(table_range(table)[0] for _, table in POSITION_TABLES)
+TABLES_JD_END = min(table_range(table)[1] for _, table in POSITION_TABLES)
+
+
+def supported_range() -> tuple:
+    """
+    First and last whole UTC minutes a chart can be requested for. Charts
+    also need the instant one hour earlier (retrograde check), so the
+    first is an hour after the tables start.
+    """
+    minute = timedelta(minutes=1)
+    tick = timedelta(microseconds=1)
+    first = ts.tdb_jd(TABLES_JD_START + 1 / 24).utc_datetime()
+    last = ts.tdb_jd(TABLES_JD_END).utc_datetime()
+    # Round the first up and the last down (the end is exclusive)
+    first = (first - tick).replace(second=0, microsecond=0) + minute
+    last = (last - tick).replace(second=0, microsecond=0)
+    return first, last
+
+
+def geocentric_km(t) -> np.ndarray:
+    """
+    Geocentric ICRS positions (km) of PLANET_BODIES at `t`, shape
+    (n_bodies, 3, len(t)).
+
+    Positions are geometric: skipping the light-time correction of
+    `observe()` shifts longitudes by up to ~40" (Mercury; ~25" for Venus
+    and the Moon, less for the outer planets). Fine for sign/degree
+    placement, but keep it in mind for tight aspect orbs.
+    """
+    tdb = t.tdb
+    if (tdb < TABLES_JD_START).any() or (tdb >= TABLES_JD_END).any():
+        first, last = supported_range()
+        raise ValueError(
+            f"Date must be between {first:%Y-%m-%d %H:%M} and "
+            f"{last:%Y-%m-%d %H:%M} UTC"
+        )
+
+    pos = np.empty((len(PLANET_BODIES), 3, len(t)))
+    for rows, table in POSITION_TABLES:
+        pos[rows] = interpolate_positions(table, t)
+    return pos
+
+
+def site_gcrs_km(location, t) -> np.ndarray:
+    """
+    GCRS position (km) of a wgs84 `location` relative to the Earth's
+    center at `t`: the ITRS vector turned by the sidereal angle, then
+    taken from the equinox of date back to ICRS. This is what
+    `location.at(t)` returns (no polar motion is loaded), without it also
+    deriving velocities through Skyfield's frame machinery.
+    """
+    itrs_km = location.itrs_xyz.km
+    return mxv(t.MT, mxv(rot_z(t.gast * tau / 24.0), itrs_km))
+
+
+def ecliptic_longitudes(pos) -> np.ndarray:
+    """
+    Compute ecliptic longitudes (0–360) from stacked ICRS position vectors
+    of shape (n_bodies, 3, n_times); returns shape (n_bodies, n_times).
+    All bodies go through one rotation and one arctan2.
+    """
+    # The rotation is about the x axis, so ecliptic x is just ICRS x and
+    # only the y row is needed (z, the latitude component, is not)
+    x = pos[:, 0]
+    y = np.einsum("j,bjt->bt", _ECLIPTIC_ROT[1], pos)
+    return (np.degrees(np.arctan2(y, x)) + 360.0) % 360.0
 
 
 def compute_asc_mc(t, lat_deg: float, lon_deg: float):
@@ -85,59 +330,152 @@ def compute_asc_mc(t, lat_deg: float, lon_deg: float):
     return asc, mc
 
 
-@app.post("/chart")
-def chart(req: ChartRequest):
-    # 1) Build local datetime
-    try:
-        dt_local = datetime.strptime(
-            f"{req.date} {req.time}", "%Y-%m-%d %H:%M"
-        )
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid date or time format")
+def chart_instants(dts_utc: list) -> tuple:
+    """
+    Everything in a chart that depends only on time, not location: the
+    Skyfield times (one hour earlier for every chart, for the retrograde
+    check, then "now" for every chart) and the geocentric positions at them.
+    M, MT and gast are materialized here, so a cached Time is fully built
+    before other threads share it.
+    """
+    hour = timedelta(hours=1)
+    t = skyfield_times([dt - hour for dt in dts_utc] + list(dts_utc))
+    geo_km = geocentric_km(t)
+    t.MT  # reified on first access; touch them while t is still private
+    t.gast
+    return t, geo_km
 
-    # 2) Convert to UTC
-    try:
-        dt_utc = to_utc(dt_local, req.timezone)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
 
-    # 3) Build Skyfield times: now and one hour earlier (for retrograde check)
-    t = ts.from_datetime(dt_utc)
-    t_prev = ts.from_datetime(dt_utc - timedelta(hours=1))
+@lru_cache(maxsize=4096)
+def minute_instants(dt_utc: datetime) -> tuple:
+    """
+    `chart_instants()` for one UTC instant, memoized: charts for different
+    locations at the same minute (e.g. everyone asking about "now") share
+    its Time, matrices and positions.
+    """
+    return chart_instants([dt_utc])
 
-    # 4) Observer on Earth
-    location = wgs84.latlon(req.lat, req.lon)
-    observer = eph["earth"] + location
 
-    # 5) Planets: longitude + retrograde
-    planets = {}
-    for name, key in PLANET_KEYS.items():
-        body = eph[key]
+def charts_at(instants: tuple, lats: list, lons: list) -> list:
+    """
+    Compute ASC, MC and planet positions for the `chart_instants()` of many
+    UTC instants, one location per instant. Every chart shares one Skyfield
+    Time array, so the work is vectorized across the batch.
+    Returns one chart dict per location, in order.
+    """
+    t, geo_km = instants
+    n = len(lats)
 
-        lon_now = ecliptic_longitude(body, t, observer)
-        lon_prev = ecliptic_longitude(body, t_prev, observer)
+    # 1) Observers on Earth, one per instant in t; shared by every body
+    lat_t = np.tile(np.asarray(lats, dtype=float), 2)
+    lon_t = np.tile(np.asarray(lons, dtype=float), 2)
+    location = wgs84.latlon(lat_t, lon_t)
 
-        # Change in longitude (normalized to -180..+180)
-        delta = (lon_now - lon_prev + 540.0) % 360.0 - 180.0
-        retrograde = delta < 0  # moving backwards through zodiac
+    # 2) Planets as seen by each observer: longitude + retrograde,
+    #    shape (n_bodies, n). Positions stay topocentric for every body:
+    #    parallax is ~1° for the Moon but also up to ~9" for the Sun and
+    #    ~30" for Venus, and the site offset is one shared vector anyway.
+    pos = geo_km - site_gcrs_km(location, t)
+    planet_lons = ecliptic_longitudes(pos)
+    lon_prev, lon_now = planet_lons[:, :n], planet_lons[:, n:]
 
-        planets[name] = {
-            "lon": lon_now,
-            "retrograde": retrograde,
-        }
+    # Change in longitude (normalized to -180..+180), all bodies at once
+    delta = (lon_now - lon_prev + 540.0) % 360.0 - 180.0
+    retrograde = delta < 0  # moving backwards through zodiac
 
-    # 6) ASC & MC
-    asc, mc = compute_asc_mc(t, req.lat, req.lon)
+    # 3) ASC & MC (for "now", the second half of t)
+    asc, mc = compute_asc_mc(t, lat_t, lon_t)
 
-    # 7) Return data; houses and true_node are placeholders for future
-    return {
-        "engine": "skyfield_de421",
-        "input": req.model_dump(),
-        "chart": {
-            "asc": asc,
-            "mc": mc,
+    charts = []
+    for asc_i, mc_i, lon_i, retro_i in zip(
+        asc[n:].tolist(), mc[n:].tolist(),
+        lon_now.T.tolist(), retrograde.T.tolist(),
+    ):
+        planets = {
+            name: {"lon": lon, "retrograde": retro}
+            for (name, _), lon, retro in zip(PLANET_BODIES, lon_i, retro_i)
+        }
+        charts.append({
+            "asc": asc_i,
+            "mc": mc_i,
             "planets": planets,
             "houses": None,
             "true_node": None,
-        },
+        })
+    return charts
+
+
+def compute_charts(dts_utc: list, lats: list, lons: list) -> list:
+    """
+    Compute ASC, MC and planet positions for many UTC instants and
+    locations at once (not cached). Returns one chart dict per input.
+    """
+    return charts_at(chart_instants(dts_utc), lats, lons)
+
+
+@lru_cache(maxsize=10_000)
+def compute_chart(dt_utc: datetime, lat: float, lon: float) -> dict:
+    """
+    Compute ASC, MC and planet positions for a UTC instant and location.
+    Memoized: callers round lat/lon so repeat requests for the same chart
+    are served from the cache. Treat the returned dict as read-only.
+    """
+    return charts_at(minute_instants(dt_utc), [lat], [lon])[0]
+
+
+@app.post("/chart")
+async def chart(req: ChartRequest):
+    # 1) Convert local datetime (built by ChartRequest) to UTC
+    try:
+        dt_utc = to_utc(req.dt_local, req.timezone)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 2) Chart for this instant; ~0.001° (~100 m) location buckets
+    #    make repeat requests cache hits without visibly moving anything.
+    #    Skyfield work is CPU-bound, so keep it off the event loop.
+    try:
+        chart_data = await asyncio.to_thread(
+            compute_chart, dt_utc, round(req.lat, 3), round(req.lon, 3)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 3) Return data; houses and true_node are placeholders for future
+    return {
+        "engine": ENGINE,
+        "input": req.model_dump(),
+        "chart": chart_data,
     }
+
+
+@app.post("/batch_chart")
+async def batch_chart(
+    reqs: Annotated[list[ChartRequest], Field(max_length=MAX_BATCH_CHARTS)],
+):
+    if not reqs:
+        return []
+
+    # 1) Convert every local datetime to UTC
+    try:
+        dts_utc = [to_utc(req.dt_local, req.timezone) for req in reqs]
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 2) All charts in one vectorized pass (not cached); locations are
+    #    bucketed like /chart so both endpoints return the same numbers
+    try:
+        charts = await asyncio.to_thread(
+            compute_charts,
+            dts_utc,
+            [round(req.lat, 3) for req in reqs],
+            [round(req.lon, 3) for req in reqs],
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 3) Return data in request order, shaped like /chart responses
+    return [
+        {"engine": ENGINE, "input": req.model_dump(), "chart": chart_data}
+        for req, chart_data in zip(reqs, charts)
+    ]